@@ -1,13 +1,18 @@
 import asyncio
+import hashlib
 import json
 import logging
 import os
-from datetime import datetime
-
-import praw
-import prawcore
+from dataclasses import dataclass, field
+from itertools import islice
+
+import asyncpraw
+import asyncprawcore
+import msgpack
+import orjson
+from cachetools import TTLCache
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from openai import OpenAI
+from openai import AsyncOpenAI
 import uvicorn # Solo para el if __name__ == '__main__' local
 
 # --- Configuración --- 
@@ -25,6 +30,7 @@ COMMENT_LIMIT_PER_POST = 100
 REPLACE_MORE_LIMIT = 0 # No expandir comentarios anidados para velocidad
 TOTAL_COMMENTS_TARGET = 100 
 MAX_COMMENTS_PER_POST_TARGET = 10
+HARVEST_CONCURRENCY = 8 # Posts cuyos comentarios se descargan en paralelo
 
 # Filtros de Comentarios
 MIN_COMMENT_WORDS = 10
@@ -34,17 +40,37 @@ MIN_COMMENT_SCORE = 1
 AI_MODEL_NAME = "google/gemini-flash-1.5"
 MAX_INPUT_CHARS_AI = 15000 
 
+# Prompts de la IA (la parte fija se construye una sola vez)
+SYSTEM_PROMPT = "Eres un asistente de análisis de mercado experto. Analiza los siguientes comentarios de Reddit sobre un tema específico. Tu objetivo es extraer información valiosa para entender al público."
+USER_PROMPT_TEMPLATE = "Aquí tienes una colección de comentarios de Reddit sobre el tema '{term}':\n\n---\n{comments}\n---\n\nPor favor, realiza un análisis conciso e identifica:\n1.  **Términos Clave y Temas Recurrentes:** Palabras o conceptos que aparecen frecuentemente.\n2.  **Situaciones, Problemas o Necesidades Comunes:** ¿Qué circunstancias o dificultades mencionan los usuarios relacionadas con el tema?\n3.  **Sentimientos Generales:** ¿Hay tendencias claras de opiniones positivas, negativas o neutrales? Menciona ejemplos si es posible.\n4.  **Posibles Insights:** ¿Alguna observación interesante o conclusión que se pueda sacar sobre este público o mercado basada en los comentarios?\n\nFormatea tu respuesta usando Markdown para claridad."
+
+# Mensajes pendientes de un socket a partir de los cuales se descartan los 'status' ya superados
+STATUS_BACKLOG_LIMIT = 64
+
+# Comentarios por frame al enviar los datos finales
+FINAL_DATA_CHUNK_SIZE = 10
+
+# Caché de análisis (evita repetir llamadas a Reddit/OpenRouter para búsquedas repetidas)
+ANALYSIS_CACHE_SIZE = 256
+ANALYSIS_CACHE_TTL = 600 # Segundos, por conjunto de comentarios
+RECENT_TERM_CACHE_TTL = 60 # Segundos, por término (salta también la búsqueda en Reddit)
+
 # Configuración de Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Clientes (Inicialización asíncrona opcional si se necesita) ---
-# Nota: PRAW no es nativamente async, OpenAI sí puede serlo pero lo usamos sync aquí
+# Nota: ambos clientes son async (Async PRAW y AsyncOpenAI)
 reddit_instance = None
 openrouter_client = None
 
-# --- Funciones Core (Sincrónicas, llamadas desde el generador async) ---
+# (término, huella de comentarios) -> texto del análisis
+analysis_cache = TTLCache(maxsize=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL)
+# término -> (comentarios, texto del análisis)
+recent_term_cache = TTLCache(maxsize=ANALYSIS_CACHE_SIZE, ttl=RECENT_TERM_CACHE_TTL)
+
+# --- Funciones Core (llamadas desde el generador async) ---
 
-def initialize_praw_sync(client_id, client_secret, user_agent):
+async def initialize_praw(client_id, client_secret, user_agent):
     global reddit_instance
     if reddit_instance is None:
         # Loggear si las variables están presentes o no
@@ -55,22 +81,40 @@ def initialize_praw_sync(client_id, client_secret, user_agent):
             logging.error("Secrets de Reddit no encontrados en las variables de entorno.")
             return None
         try:
-            logging.info("Inicializando conexión PRAW...")
-            reddit_instance = praw.Reddit(
+            logging.info("Inicializando conexión Async PRAW...")
+            reddit_instance = asyncpraw.Reddit(
                 client_id=client_id, client_secret=client_secret, user_agent=user_agent
             )
-            # Test connection by fetching user info
-            user_info = reddit_instance.user.me()
-            logging.info(f"Conectado a Reddit como: {user_info}")
-        except prawcore.exceptions.OAuthException as auth_error:
+            # Solo con client_id/secret el cliente es de solo lectura y user.me() no está disponible
+            if reddit_instance.read_only:
+                logging.info("Cliente de Reddit inicializado en modo solo lectura.")
+            else:
+                # Test connection by fetching user info
+                user_info = await reddit_instance.user.me()
+                logging.info(f"Conectado a Reddit como: {user_info}")
+        except asyncprawcore.exceptions.OAuthException as auth_error:
             logging.error(f"Error de AUTENTICACIÓN con Reddit (OAuth): {auth_error}. ¿Credenciales correctas en variables?")
-            reddit_instance = None
+            await close_praw()
         except Exception as e:
             logging.error(f"Error inicializando PRAW: {e}")
-            reddit_instance = None
+            await close_praw()
     return reddit_instance
 
-def initialize_openrouter_client_sync(api_key):
+async def close_praw():
+    """Cierra la sesión HTTP del cliente de Reddit, si existe."""
+    global reddit_instance
+    if reddit_instance is not None:
+        await reddit_instance.close()
+        reddit_instance = None
+
+async def close_openrouter_client():
+    """Cierra el pool de conexiones HTTP del cliente OpenRouter, si existe."""
+    global openrouter_client
+    if openrouter_client is not None:
+        await openrouter_client.close()
+        openrouter_client = None
+
+async def initialize_openrouter_client(api_key):
     global openrouter_client
     if openrouter_client is None:
         logging.info(f"Leyendo OPENROUTER_API_KEY: {'Presente' if api_key else 'AUSENTE'}")
@@ -79,10 +123,10 @@ def initialize_openrouter_client_sync(api_key):
             return None
         try:
             logging.info("Inicializando cliente OpenRouter...")
-            openrouter_client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
+            openrouter_client = AsyncOpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
             # Realizar una llamada simple para verificar la clave (opcional, puede costar tokens mínimos)
             # try:
-            #     openrouter_client.models.list()
+            #     await openrouter_client.models.list()
             #     logging.info("Llamada de prueba a OpenRouter exitosa.")
             # except Exception as test_call_error:
             #     logging.error(f"Error en llamada de prueba a OpenRouter: {test_call_error}. ¿Clave API válida?")
@@ -94,98 +138,323 @@ def initialize_openrouter_client_sync(api_key):
             openrouter_client = None
     return openrouter_client
 
-def is_comment_valid(comment, min_words, min_score):
-    """Verifica si un comentario cumple con los criterios de filtro."""
-    return (
-        comment.body and
-        comment.body != '[deleted]' and
-        comment.body != '[removed]' and
-        len(comment.body.split()) >= min_words and
-        comment.score >= min_score
-    )
-
-# --- Generador Asíncrono para WebSocket ---
-
-async def run_analysis_stream(websocket: WebSocket, search_term: str):
-    """Realiza el análisis y envía actualizaciones/resultados vía WebSocket."""
-    global reddit_instance, openrouter_client # Usa las instancias globales
-    
-    # Función auxiliar para enviar mensajes JSON por WebSocket
-    async def send_json(data_type: str, payload: any):
+def is_comment_valid(body, score, min_words, min_score):
+    """Verifica si un comentario cumple con los criterios de filtro.
+
+    Las palabras se cuentan por espacios (aproximación que evita crear la lista de `split()`)."""
+    if not body or body == '[deleted]' or body == '[removed]':
+        return False
+    if score < min_score:
+        return False
+    # N palabras separadas por espacios ocupan al menos 2N-1 caracteres
+    if len(body) < 2 * min_words - 1:
+        return False
+    return body.count(' ') + 1 >= min_words
+
+@dataclass
+class CommentHarvest:
+    """Comentarios recolectados en columnas paralelas (una lista por campo)."""
+    post_titles: list[str] = field(default_factory=list)
+    post_ids: list[str] = field(default_factory=list)
+    ids: list[str] = field(default_factory=list)
+    bodies: list[str] = field(default_factory=list)
+    scores: list[int] = field(default_factory=list)
+    utcs: list[int] = field(default_factory=list) # Epoch UTC en segundos; el cliente lo formatea
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, post_title, post_id, comment_id, body, score, utc):
+        self.post_titles.append(post_title)
+        self.post_ids.append(post_id)
+        self.ids.append(comment_id)
+        self.bodies.append(body)
+        self.scores.append(score)
+        self.utcs.append(utc)
+
+    def columns(self):
+        return (self.post_titles, self.post_ids, self.ids, self.bodies, self.scores, self.utcs)
+
+    def extend(self, other, stop=None):
+        """Añade las primeras `stop` filas de `other` (todas si es None), columna a columna."""
+        for column, other_column in zip(self.columns(), other.columns()):
+            column.extend(other_column[:stop])
+
+    def take(self, indices):
+        """Nuevo CommentHarvest con solo las filas `indices`, construido columna a columna."""
+        return CommentHarvest(*([column[i] for i in indices] for column in self.columns()))
+
+    def to_dicts(self):
+        """Un dict por comentario, solo para enviarlos al cliente."""
+        return [
+            {
+                'post_title': post_title,
+                'post_id': post_id,
+                'comment_id': comment_id,
+                'comment_body': body,
+                'comment_score': score,
+                'comment_utc': utc
+            }
+            for post_title, post_id, comment_id, body, score, utc in zip(
+                self.post_titles, self.post_ids, self.ids, self.bodies, self.scores, self.utcs
+            )
+        ]
+
+async def harvest_comments(submission):
+    """Descarga los comentarios de un post y devuelve los válidos."""
+    await submission.load()
+    await submission.comments.replace_more(limit=REPLACE_MORE_LIMIT)
+    comments = submission.comments.list()
+
+    # Leer cada atributo una sola vez y filtrar sobre tuplas planas; islice corta al llegar al máximo por post
+    Comment = asyncpraw.models.Comment
+    raw = ((c.id, c.body, c.score, c.created_utc) for c in comments if isinstance(c, Comment))
+    valid = (t for t in raw if is_comment_valid(t[1], t[2], MIN_COMMENT_WORDS, MIN_COMMENT_SCORE))
+
+    harvested = CommentHarvest()
+    post_title, post_id = submission.title, submission.id
+    for comment_id, body, score, created_utc in islice(valid, MAX_COMMENTS_PER_POST_TARGET):
+        harvested.append(post_title, post_id, comment_id, body, score, int(created_utc))
+    return harvested
+
+def build_ai_input(bodies, max_chars, sep="\n\n"):
+    """Une los comentarios para la IA en una sola pasada, truncando al superar `max_chars`."""
+    parts = []
+    total = 0
+    for body in bodies:
+        piece = sep + body if parts else body
+        if total + len(piece) > max_chars:
+            logging.warning(f"Truncando texto para IA (> {max_chars} caracteres)")
+            parts.append(piece[:max_chars - total])
+            parts.append("... [TRUNCADO]")
+            break
+        parts.append(piece)
+        total += len(piece)
+    return "".join(parts)
+
+def comments_digest(comments):
+    """Huella del conjunto de comentarios, independiente del orden en que se recolectaron."""
+    ids = sorted(comments.ids)
+    return hashlib.blake2b("\n".join(ids).encode(), digest_size=16).hexdigest()
+
+async def send_cached_analysis(send_json, analysis, comments_data):
+    """Envía un análisis ya calculado y los comentarios, como al final de un análisis normal."""
+    await send_json("status", "Análisis recuperado de la caché.")
+    await send_json("ai_chunk", analysis)
+    await send_json("status", "Análisis de IA completado.")
+    await send_final_data(send_json, comments_data)
+
+async def send_final_data(send_json, comments_data):
+    """Envía los comentarios en bloques de FINAL_DATA_CHUNK_SIZE, seguidos de 'final_data_end'."""
+    comments = comments_data.to_dicts()
+    for i in range(0, len(comments), FINAL_DATA_CHUNK_SIZE):
+        await send_json("final_data_chunk", {"index": i, "total": len(comments), "items": comments[i:i + FINAL_DATA_CHUNK_SIZE]})
+    await send_json("final_data_end", {"total": len(comments)})
+
+# --- Escritor WebSocket con agrupación de mensajes ---
+
+# Mensajes grandes que se envían como frame binario MessagePack en lugar de JSON
+BINARY_MESSAGE_TYPES = {"final_data_chunk"}
+
+def coalesce_messages(messages):
+    """Une los fragmentos 'ai_chunk' consecutivos en un único mensaje, preservando el orden."""
+    coalesced = []
+    for data_type, payload in messages:
+        if data_type == "ai_chunk" and coalesced and coalesced[-1]["type"] == "ai_chunk":
+            coalesced[-1]["payload"] += payload
+        else:
+            coalesced.append({"type": data_type, "payload": payload})
+    return coalesced
+
+async def send_frames(websocket: WebSocket, messages):
+    """Envía los mensajes JSON pendientes en un solo frame de texto y los de
+    BINARY_MESSAGE_TYPES como frames binarios MessagePack, preservando el orden."""
+    pending = []
+    for message in messages + [None]:
+        if message is not None and message["type"] not in BINARY_MESSAGE_TYPES:
+            pending.append(message)
+            continue
+        if pending:
+            # Un solo mensaje se envía tal cual; varios se agrupan en un frame de tipo "batch"
+            frame = pending[0] if len(pending) == 1 else {"type": "batch", "payload": pending}
+            await websocket.send_text(orjson.dumps(frame).decode())
+            pending = []
+        if message is not None:
+            await websocket.send_bytes(msgpack.packb(message, use_bin_type=True))
+
+def drop_stale_status(messages):
+    """Conserva solo el 'status' más reciente; el resto de mensajes se mantiene en orden."""
+    last_status = max((i for i, (data_type, _) in enumerate(messages) if data_type == "status"), default=None)
+    return [m for i, m in enumerate(messages) if m[0] != "status" or i == last_status]
+
+async def websocket_writer(websocket: WebSocket, broadcast):
+    """Único escritor del socket: recorre el historial del análisis con su propio cursor,
+    toma de una vez todos los mensajes nuevos y los envía en un solo frame.
+    Termina cuando el análisis se cierra y ya se envió todo el historial."""
+    cursor = 0
+    while True:
+        await broadcast.wait_for_messages(cursor)
+        batch = broadcast.history[cursor:]
+        if not batch:
+            return
+        cursor += len(batch)
+        if len(batch) > STATUS_BACKLOG_LIMIT:
+            # Cliente lento: los 'status' intermedios ya no aportan y los 'ai_chunk' se fusionan al agrupar
+            batch = drop_stale_status(batch)
+        messages = coalesce_messages(batch)
         try:
-            await websocket.send_json({"type": data_type, "payload": payload})
+            await send_frames(websocket, messages)
         except WebSocketDisconnect:
             logging.warning("WebSocket desconectado por el cliente.")
-            raise # Re-lanzar para detener el generador
+            raise
         except Exception as e:
             logging.error(f"Error enviando mensaje WebSocket: {e}")
             raise
 
+class AnalysisBroadcast:
+    """Mensajes de un análisis en curso, compartidos por todos los sockets que pidieron el mismo término.
+
+    Cada socket recorre `history` a su ritmo con su propio cursor (ver websocket_writer), así que
+    un cliente lento o que se suscribe tarde no retrasa al análisis ni a los demás clientes."""
+
+    def __init__(self):
+        self.history = [] # Todos los mensajes emitidos, en orden
+        self.writer_tasks = [] # Una tarea escritora por socket
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def subscribe(self, websocket: WebSocket):
+        # El socket cuenta como activo desde ya, aunque aún no haya enviado el historial previo
+        writer_task = asyncio.create_task(websocket_writer(websocket, self))
+        self.writer_tasks.append(writer_task)
+        return writer_task
+
+    def publish(self, message):
+        if all(writer_task.done() for writer_task in self.writer_tasks):
+            # Todos los clientes se desconectaron: detener el análisis
+            raise WebSocketDisconnect()
+        self.history.append(message)
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_messages(self, cursor):
+        """Espera hasta que haya mensajes a partir de `cursor` o el análisis se cierre."""
+        while cursor >= len(self.history) and not self.closed:
+            await self._changed.wait()
+
+# Análisis en curso por término de búsqueda (single-flight)
+inflight_analyses = {}
+
+# --- Generador Asíncrono para WebSocket ---
+
+async def run_analysis_stream(websocket: WebSocket, search_term: str):
+    """Realiza el análisis y envía actualizaciones/resultados vía WebSocket."""
+    broadcast = inflight_analyses.get(search_term)
+    if broadcast is not None:
+        # Ya hay un análisis en curso para este término: recibir sus mensajes en vez de repetirlo
+        logging.info(f"Uniéndose al análisis en curso para: '{search_term}'")
+        await broadcast.subscribe(websocket)
+        return
+
+    broadcast = inflight_analyses[search_term] = AnalysisBroadcast()
+    writer_task = broadcast.subscribe(websocket)
+
+    # Función auxiliar para enviar mensajes: los añade al historial, que los escritores agrupan
+    async def send_json(data_type: str, payload: any):
+        broadcast.publish((data_type, payload))
+
+    try:
+        await run_analysis(send_json, search_term)
+    finally:
+        del inflight_analyses[search_term]
+        broadcast.close()
+        # Propaga WebSocketDisconnect (u otro error) del escritor propio al endpoint
+        await writer_task
+
+async def run_analysis(send_json, search_term: str):
+    """Busca en Reddit, analiza con IA y emite cada actualización mediante `send_json`."""
+    global reddit_instance, openrouter_client # Usa las instancias globales
+
     await send_json("status", "Inicializando...")
 
-    # Inicializar clientes (bloqueante, pero hecho una vez por instancia)
-    # En una app más compleja, se podrían inicializar al arrancar FastAPI
-    reddit = initialize_praw_sync(CLIENT_ID, CLIENT_SECRET, USER_AGENT)
+    recent = recent_term_cache.get(search_term)
+    if recent is not None:
+        comments_data, analysis = recent
+        await send_cached_analysis(send_json, analysis, comments_data)
+        return
+
+    # Los clientes se inicializan al arrancar FastAPI (ver startup)
+    reddit = reddit_instance
     if not reddit:
         await send_json("error", "Fallo al conectar con Reddit. Verifica las secrets.")
         return
         
-    client_ai = initialize_openrouter_client_sync(OPENROUTER_API_KEY)
+    client_ai = openrouter_client
     if not client_ai:
         await send_json("error", "Fallo al conectar con OpenRouter. Verifica la API Key.")
         return
 
     # --- Búsqueda y Recolección Reddit --- 
-    collected_comments_data = []
-    collected_comment_ids = set()
+    collected_comments_data = CommentHarvest()
+    collected_comment_ids = set() # IDs de Reddit (base 36) como enteros: menos memoria y hash más rápido
     posts_procesados = 0
     await send_json("status", f"Buscando posts para '{search_term}'...")
 
     try:
-        # Nota: praw.search no es async. Se ejecuta de forma bloqueante aquí.
-        # Para mayor rendimiento, se podría ejecutar en un thread pool con asyncio.to_thread
-        subreddit = reddit.subreddit(SUBREDDIT_TO_SEARCH)
-        search_results = list(subreddit.search(search_term, sort=SORT_POSTS_BY, limit=SEARCH_LIMIT_POSTS))
-        
-        await send_json("status", f"{len(search_results)} posts encontrados inicialmente.")
-
-        for i, submission in enumerate(search_results):
-            if len(collected_comments_data) >= TOTAL_COMMENTS_TARGET:
-                await send_json("status", f"Límite total de {TOTAL_COMMENTS_TARGET} comentarios alcanzado.")
-                break
-            
+        async def harvest_post(submission):
+            nonlocal posts_procesados
+            harvested = await harvest_comments(submission)
             posts_procesados += 1
-            status_msg = f"Procesando Post {posts_procesados}/{len(search_results)}: '{submission.title[:50]}...'"
+            status_msg = f"Post {posts_procesados} procesado: '{submission.title[:50]}...'"
             await send_json("status", status_msg)
             logging.info(status_msg) # Loggear también
-            
-            # Procesamiento de comentarios (también bloqueante)
-            comments_added_from_post = 0
-            # Poner replace_more a 0 o manejarlo en thread si se necesita
-            try:
-                 # Iterar sobre comentarios de nivel superior
-                for comment in submission.comments.list(): 
-                    if len(collected_comments_data) >= TOTAL_COMMENTS_TARGET:
-                        break 
-                    if comments_added_from_post >= MAX_COMMENTS_PER_POST_TARGET:
-                        break
-
-                    if isinstance(comment, praw.models.Comment) and comment.id not in collected_comment_ids:
-                        if is_comment_valid(comment, MIN_COMMENT_WORDS, MIN_COMMENT_SCORE):
-                            collected_comments_data.append({
-                                'post_title': submission.title,
-                                'post_id': submission.id,
-                                'comment_id': comment.id,
-                                'comment_body': comment.body,
-                                'comment_score': comment.score,
-                                'comment_utc_date': datetime.utcfromtimestamp(comment.created_utc).strftime('%Y-%m-%d %H:%M:%S UTC')
-                            })
-                            collected_comment_ids.add(comment.id)
-                            comments_added_from_post += 1
-            except Exception as comment_error:
-                 logging.warning(f"Error procesando comentarios del post {submission.id}: {comment_error}")
-
-            await asyncio.sleep(0.05) # Pequeña pausa para permitir que otros eventos ocurran
+            return harvested
+
+        async def harvest_batch(batch):
+            """Descarga en paralelo los comentarios de un bloque de posts y los une en orden de búsqueda."""
+            results = await asyncio.gather(*(harvest_post(s) for s in batch), return_exceptions=True)
+            for submission, result in zip(batch, results):
+                if isinstance(result, WebSocketDisconnect):
+                    raise result
+                if isinstance(result, Exception):
+                    logging.warning(f"Error procesando comentarios del post {submission.id}: {result}")
+                    continue
+                room = TOTAL_COMMENTS_TARGET - len(collected_comments_data)
+                if room <= 0:
+                    break
+                comment_keys = [int(comment_id, 36) for comment_id in result.ids]
+                if not collected_comment_ids.isdisjoint(comment_keys):
+                    # Caso raro (post repetido en la búsqueda): conservar solo los comentarios nuevos
+                    fresh = [i for i, comment_key in enumerate(comment_keys) if comment_key not in collected_comment_ids]
+                    result = result.take(fresh)
+                    comment_keys = [comment_keys[i] for i in fresh]
+                collected_comments_data.extend(result, room)
+                collected_comment_ids.update(comment_keys[:room])
+
+        # Los posts se procesan a medida que llegan de la búsqueda, en bloques de HARVEST_CONCURRENCY;
+        # al alcanzar el límite de comentarios no se piden más páginas
+        subreddit = await reddit.subreddit(SUBREDDIT_TO_SEARCH)
+        batch = []
+        async for submission in subreddit.search(search_term, sort=SORT_POSTS_BY, limit=SEARCH_LIMIT_POSTS):
+            batch.append(submission)
+            if len(batch) < HARVEST_CONCURRENCY:
+                continue
+            await harvest_batch(batch)
+            batch = []
+            if len(collected_comments_data) >= TOTAL_COMMENTS_TARGET:
+                break
+        if batch:
+            await harvest_batch(batch)
+
+        if len(collected_comments_data) >= TOTAL_COMMENTS_TARGET:
+            await send_json("status", f"Límite total de {TOTAL_COMMENTS_TARGET} comentarios alcanzado.")
 
     except WebSocketDisconnect:
         return # Salir limpiamente si el cliente se desconecta
@@ -197,39 +466,44 @@ async def run_analysis_stream(websocket: WebSocket, search_term: str):
     # --- Enviar Datos Recolectados (Opcional, si se quieren antes del análisis) ---
     await send_json("status", f"Recolección finalizada. {len(collected_comments_data)} comentarios válidos encontrados.")
     # Podríamos enviar la lista completa aquí si el cliente la necesita antes del análisis
-    # await send_json("reddit_data", collected_comments_data)
+    # await send_json("reddit_data", collected_comments_data.to_dicts())
 
     # --- Llamada a IA con Streaming --- 
     if not collected_comments_data:
         await send_json("status", "No se encontraron comentarios válidos para análisis.")
         return
 
-    comments_text_for_ai = "\n\n".join([c['comment_body'] for c in collected_comments_data])
-    if len(comments_text_for_ai) > MAX_INPUT_CHARS_AI:
-        logging.warning(f"Truncando texto para IA ({len(comments_text_for_ai)} > {MAX_INPUT_CHARS_AI})")
-        comments_text_for_ai = comments_text_for_ai[:MAX_INPUT_CHARS_AI] + "... [TRUNCADO]"
+    cache_key = (search_term, comments_digest(collected_comments_data))
+    analysis = analysis_cache.get(cache_key)
+    if analysis is not None:
+        recent_term_cache[search_term] = (collected_comments_data, analysis)
+        await send_cached_analysis(send_json, analysis, collected_comments_data)
+        return
+
+    comments_text_for_ai = build_ai_input(collected_comments_data.bodies, MAX_INPUT_CHARS_AI)
         
-    system_prompt = "Eres un asistente de análisis de mercado experto. Analiza los siguientes comentarios de Reddit sobre un tema específico. Tu objetivo es extraer información valiosa para entender al público."
-    user_prompt = f"Aquí tienes una colección de comentarios de Reddit sobre el tema '{search_term}':\n\n---\n{comments_text_for_ai}\n---\n\nPor favor, realiza un análisis conciso e identifica:\n1.  **Términos Clave y Temas Recurrentes:** Palabras o conceptos que aparecen frecuentemente.\n2.  **Situaciones, Problemas o Necesidades Comunes:** ¿Qué circunstancias o dificultades mencionan los usuarios relacionadas con el tema?\n3.  **Sentimientos Generales:** ¿Hay tendencias claras de opiniones positivas, negativas o neutrales? Menciona ejemplos si es posible.\n4.  **Posibles Insights:** ¿Alguna observación interesante o conclusión que se pueda sacar sobre este público o mercado basada en los comentarios?\n\nFormatea tu respuesta usando Markdown para claridad."
+    user_prompt = USER_PROMPT_TEMPLATE.format(term=search_term, comments=comments_text_for_ai)
     
     await send_json("status", f"Llamando a IA ({AI_MODEL_NAME})...")
     
     try:
-        # Nota: La llamada a OpenAI no es async por defecto si el cliente no se inicializó async
-        # Idealmente, usaríamos un cliente async y `await client_ai.chat.completions.create`
-        # o ejecutar esto en un thread pool.
-        stream = client_ai.chat.completions.create(
+        stream = await client_ai.chat.completions.create(
             model=AI_MODEL_NAME,
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+            messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": user_prompt}],
             temperature=0.5,
             max_tokens=1024,
             stream=True
         )
-        for chunk in stream:
+        ai_parts = []
+        async for chunk in stream:
             content = chunk.choices[0].delta.content
             if content:
+                ai_parts.append(content)
                 await send_json("ai_chunk", content)
-                await asyncio.sleep(0.01) # Pequeña pausa 
+
+        analysis = "".join(ai_parts)
+        analysis_cache[cache_key] = analysis
+        recent_term_cache[search_term] = (collected_comments_data, analysis)
         
         await send_json("status", "Análisis de IA completado.")
 
@@ -240,7 +514,7 @@ async def run_analysis_stream(websocket: WebSocket, search_term: str):
         await send_json("error", f"Error en análisis IA: {str(e)}")
     
     # Enviar la lista completa de comentarios al final (opcional)
-    await send_json("final_data", {"comments": collected_comments_data})
+    await send_final_data(send_json, collected_comments_data)
     logging.info("Proceso completo para WebSocket.")
 
 
@@ -248,6 +522,17 @@ async def run_analysis_stream(websocket: WebSocket, search_term: str):
 
 app = FastAPI(title="Reddit Market Analyzer API")
 
+@app.on_event("startup")
+async def startup():
+    # Clientes únicos reutilizados por todas las conexiones; la autenticación no retrasa al primer cliente
+    await initialize_praw(CLIENT_ID, CLIENT_SECRET, USER_AGENT)
+    await initialize_openrouter_client(OPENROUTER_API_KEY)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_praw()
+    await close_openrouter_client()
+
 @app.websocket("/ws/analyze")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
@@ -284,10 +569,15 @@ async def websocket_endpoint(websocket: WebSocket):
 async def root():
     return {"message": "API de Análisis de Mercado Reddit. Conéctate al endpoint /ws/analyze vía WebSocket."}
 
+@app.get("/health")
+async def health():
+    return {"reddit": reddit_instance is not None, "openrouter": openrouter_client is not None}
+
 # --- Ejecución Local (para desarrollo) ---
 if __name__ == "__main__":
     # Leer puerto para Uvicorn, default a 8000
     port = int(os.getenv('PORT', 8000))
     logging.info(f"Iniciando servidor Uvicorn en http://localhost:{port}")
     # Nota: host="0.0.0.0" es importante para despliegues, no solo localhost
+    # Con el paquete `websockets` instalado, uvicorn negocia permessage-deflate por defecto
     uvicorn.run("reddit_scraper:app", host="0.0.0.0", port=port, reload=False) # reload=True para desarrollo 
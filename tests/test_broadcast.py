@@ -0,0 +1,95 @@
+"""Comprobaciones del reparto de mensajes a varios sockets (suscriptor atascado y suscriptor lento).
+
+Ejecutar con `python -m pytest tests` o `python tests/test_broadcast.py`.
+"""
+import asyncio
+import os
+import sys
+
+import orjson
+import msgpack
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import reddit_scraper  # noqa: E402
+
+AI_TEXT = "hola mundo " * 40
+
+
+class FakeWebSocket:
+    """Socket falso que guarda los mensajes recibidos; puede ser lento o quedarse atascado."""
+
+    def __init__(self, delay=0.0, stuck=False):
+        self.delay = delay
+        self.stuck = stuck
+        self.frames = []
+
+    async def _receive(self, frame):
+        if self.stuck and self.frames:
+            await asyncio.Event().wait()  # nunca vuelve
+        self.frames.append(frame)
+        await asyncio.sleep(self.delay)
+
+    async def send_text(self, text):
+        await self._receive(orjson.loads(text))
+
+    async def send_bytes(self, data):
+        await self._receive(msgpack.unpackb(data, raw=False))
+
+    def messages(self):
+        for frame in self.frames:
+            yield from frame["payload"] if frame["type"] == "batch" else [frame]
+
+    def ai_text(self):
+        return "".join(m["payload"] for m in self.messages() if m["type"] == "ai_chunk")
+
+
+async def fake_analysis(send_json, search_term):
+    for i, char in enumerate(AI_TEXT):
+        await send_json("status", f"Paso {i}")
+        await send_json("ai_chunk", char)
+        await asyncio.sleep(0)
+    await send_json("final_data_end", {})
+
+
+async def run_subscribers(*websockets):
+    leader, *followers = websockets
+    reddit_scraper.run_analysis = fake_analysis
+    leader_task = asyncio.create_task(reddit_scraper.run_analysis_stream(leader, "termino"))
+    await asyncio.sleep(0)
+    follower_tasks = [asyncio.create_task(reddit_scraper.run_analysis_stream(ws, "termino")) for ws in followers]
+    return leader_task, follower_tasks
+
+
+def test_stuck_subscriber_does_not_block_others():
+    async def scenario():
+        leader, stuck = FakeWebSocket(), FakeWebSocket(stuck=True)
+        leader_task, (stuck_task,) = await run_subscribers(leader, stuck)
+        await asyncio.wait_for(leader_task, timeout=2)
+        assert leader.ai_text() == AI_TEXT
+        assert list(leader.messages())[-1]["type"] == "final_data_end"
+        assert not stuck_task.done()
+        stuck_task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_gets_full_text_in_fewer_frames():
+    async def scenario():
+        leader, slow = FakeWebSocket(), FakeWebSocket(delay=0.01)
+        leader_task, (slow_task,) = await run_subscribers(leader, slow)
+        await asyncio.wait_for(asyncio.gather(leader_task, slow_task), timeout=5)
+        assert slow.ai_text() == AI_TEXT
+        assert len(slow.frames) < len(AI_TEXT)
+        # Con retraso acumulado solo llega el último 'status' de cada lote
+        statuses = [m["payload"] for m in slow.messages() if m["type"] == "status"]
+        assert len(statuses) < len(AI_TEXT)
+        assert statuses[-1] == f"Paso {len(AI_TEXT) - 1}"
+        assert list(slow.messages())[-1]["type"] == "final_data_end"
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_stuck_subscriber_does_not_block_others()
+    test_slow_subscriber_gets_full_text_in_fewer_frames()
+    print("OK")
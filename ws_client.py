@@ -1,7 +1,52 @@
 import asyncio
 import websockets
 import json
+import msgpack
+import orjson
 import sys
+import time
+
+def format_utc(epoch):
+    """Formatea la fecha UTC (epoch en segundos) que envía el servidor."""
+    return time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(epoch))
+
+def handle_message(message, comments):
+    """Procesa un mensaje del servidor, acumulando en `comments` los datos finales.
+    Devuelve True si el cliente debe terminar."""
+    msg_type = message.get("type")
+    payload = message.get("payload")
+
+    if msg_type == "batch":
+        # El servidor agrupa varios mensajes listos en un solo frame
+        for inner in payload:
+            if handle_message(inner, comments):
+                return True
+    elif msg_type == "status":
+        print(f"[ESTADO]: {payload}")
+    elif msg_type == "ai_chunk":
+        # Imprimir fragmentos de IA directamente sin salto de línea
+        print(payload, end='', flush=True)
+    elif msg_type == "final_data_chunk":
+        # Los comentarios llegan por bloques, en orden
+        for comment in payload.get('items', []):
+            comment['comment_utc_date'] = format_utc(comment['comment_utc'])
+            comments.append(comment)
+    elif msg_type == "final_data_end":
+        print("\n[DATOS FINALES]:")
+        # Imprimir de forma más legible (ej: número de comentarios)
+        print(f"  - Recibidos {len(comments)} comentarios.")
+        # Podrías imprimir algunos detalles si quieres, ej:
+        # for i, comment in enumerate(comments[:3]):
+        #     print(f"    {i+1}. {comment['comment_body'][:50]}... (Score: {comment['comment_score']})")
+        # Considerar guardar comments a un archivo aquí si es necesario
+        print("\nProceso completado en el servidor.")
+        return True # Terminar después de recibir datos finales
+    elif msg_type == "error":
+        print(f"\n[ERROR DEL SERVIDOR]: {payload}")
+        return True # Terminar si hay error
+    else:
+        print(f"[MENSAJE DESCONOCIDO]: {message}")
+    return False
 
 async def connect_and_analyze():
     uri = "ws://localhost:8000/ws/analyze" # Asegúrate que el puerto (8000) coincide con el servidor
@@ -23,35 +68,18 @@ async def connect_and_analyze():
 
             # Escuchar respuestas
             print("\n<--- Esperando respuestas del servidor...")
+            comments = []
             while True:
                 try:
                     message_str = await websocket.recv()
-                    message = json.loads(message_str)
-                    
-                    msg_type = message.get("type")
-                    payload = message.get("payload")
-
-                    if msg_type == "status":
-                        print(f"[ESTADO]: {payload}")
-                    elif msg_type == "ai_chunk":
-                        # Imprimir fragmentos de IA directamente sin salto de línea
-                        print(payload, end='', flush=True)
-                    elif msg_type == "final_data":
-                        print("\n[DATOS FINALES]:")
-                        # Imprimir de forma más legible (ej: número de comentarios)
-                        comments = payload.get('comments', [])
-                        print(f"  - Recibidos {len(comments)} comentarios.")
-                        # Podrías imprimir algunos detalles si quieres, ej:
-                        # for i, comment in enumerate(comments[:3]):
-                        #     print(f"    {i+1}. {comment['comment_body'][:50]}... (Score: {comment['comment_score']})")
-                        # Considerar guardar payload['comments'] a un archivo aquí si es necesario
-                        print("\nProceso completado en el servidor.")
-                        break # Terminar después de recibir datos finales
-                    elif msg_type == "error":
-                        print(f"\n[ERROR DEL SERVIDOR]: {payload}")
-                        break # Terminar si hay error
+                    # Los frames binarios (p. ej. final_data_chunk) llegan en MessagePack; los de texto en JSON
+                    if isinstance(message_str, bytes):
+                        message = msgpack.unpackb(message_str, raw=False)
                     else:
-                        print(f"[MENSAJE DESCONOCIDO]: {message}")
+                        message = orjson.loads(message_str)
+
+                    if handle_message(message, comments):
+                        break
                         
                 except websockets.exceptions.ConnectionClosedOK:
                     print("\nConexión cerrada limpiamente por el servidor.")
@@ -59,7 +87,7 @@ async def connect_and_analyze():
                 except websockets.exceptions.ConnectionClosedError as e:
                     print(f"\nConexión cerrada con error: {e}")
                     break
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     print(f"\n<--- Recibido mensaje no JSON: {message_str}")
                 except Exception as e:
                     print(f"\nError procesando mensaje: {e}")